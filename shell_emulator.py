@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import posixpath
 import shlex
 import socket
 import sys
@@ -7,161 +8,246 @@ import re
 import argparse
 import zipfile
 import base64
+import collections
+
+# \$, $VAR и ${VAR} — компилируем один раз при загрузке модуля
+_ENV_RE = re.compile(r'\\\$|\$(\w+)|\$\{([^}]+)\}')
+_ENV_SUB = _ENV_RE.sub
+# %u, %h, %d в пользовательском приглашении
+_PROMPT_SUB = re.compile(r'%([uhd])').sub
+
+# Токенизатор для подмножества POSIX-синтаксиса, которое использует эмулятор:
+# слова, '...' и "..." (склеиваются, как в shlex), экранирование через \.
+# Вторая ветка ловит незакрытую кавычку или \ в конце строки.
+_TOKEN_RE = re.compile(r'''((?:[^ \t\r\n'"\\]+|"(?:[^"\\]|\\.)*"|'[^']*'|\\.)+)|\S''', re.S)
+_PIECE_RE = re.compile(r'''"((?:[^"\\]|\\.)*)"|'([^']*)'|\\(.)|([^'"\\]+)''', re.S)
+_DQ_ESC_SUB = re.compile(r'\\(["\\])').sub
+_HAS_QUOTES = re.compile(r'[\'"\\]').search
+
+# Строка-комментарий в стартовом скрипте
+_COMMENT_MATCH = re.compile(r'\s*#(.*)').match
+
+# Дешёвая проверка перед base64-декодированием
+_looks_base64 = re.compile(rb'[A-Za-z0-9+/=\s]+').fullmatch
+
+# Пользователь и хост не меняются за время сессии
+_USER = os.environ.get('USER') or os.environ.get('USERNAME') or 'user'
+_HOST = socket.gethostname()
 
 # --- ХРАНЕНИЕ ИСТОРИИ ---
-command_history = []
+# Хранятся последние HISTORY_SIZE команд; нумерация сквозная с начала сессии
+HISTORY_SIZE = 1000
+command_history = collections.deque(maxlen=HISTORY_SIZE)
+_history_offset = 0     # сколько старых записей уже вытеснено
+
+
+def add_history(line):
+    global _history_offset
+    if len(command_history) == command_history.maxlen:
+        _history_offset += 1
+    command_history.append(line)
+
 
 # -------------------------------------------------------------
 # VFS — виртуальная файловая система
 # -------------------------------------------------------------
+# Узел-каталог. Отдельный класс, чтобы отличать каталог от файла
+# одним сравнением типа: node.__class__ is DirNode
+class DirNode(dict):
+    __slots__ = ()
+
+
 class VFS:
     def __init__(self):
-        self.root = {}          # корень — dict
-        self.cwd = []           # текущий путь в виде списка: ["home", "user"]
+        # Плоская таблица узлов: канонический абсолютный путь -> узел
+        self.nodes = {'/': DirNode(type='dir')}
+        # Индекс каталогов: путь каталога -> список имён его содержимого
+        self.children = {'/': []}
+        self.cwd = '/'          # текущий путь — каноническая строка: "/home/user"
+        # Кэш предков cwd: [("/", узел), ("/home", узел), ("/home/user", узел)]
+        self._ancestor_cache = [('/', self.nodes['/'])]
+        # Последнее приглашение: ((cwd, шаблон), строка) — см. prompt()
+        self._prompt_cache = (None, None)
+
+    # Канонизация пути: абсолютный или относительный (от cwd) -> "/a/b/c".
+    # Разбор "."/".." делает normpath; lstrip убирает POSIX-особенность "//a"
+    def _canon(self, path):
+        if not path.startswith('/'):
+            path = self.cwd + '/' + path
+        return '/' + posixpath.normpath(path).lstrip('/')
+
+    # Добавление каталогов (вместе с недостающими родителями)
+    def add_dir(self, path):
+        cur = '/'
+        for p in path.split('/'):
+            if not p:
+                continue
+            child = _join(cur, p)
+            if child not in self.nodes:
+                self.nodes[child] = DirNode(type='dir')
+                self.children[child] = []
+                self.children[cur].append(p)
+            cur = child
+        return cur
 
     # Добавление файла
     def add_file(self, path, data):
-        parts = path.split('/')
-        cur = self.root
-        for p in parts[:-1]:
-            cur = cur.setdefault(p, {})
-        cur[parts[-1]] = {'type': 'file', 'data': data}
-
-    # Добавление каталогов
-    def add_dir(self, path):
-        parts = path.split('/')
-        cur = self.root
-        for p in parts:
-            cur = cur.setdefault(p, {})
-
-    # Нахождение узла по пути (теперь всегда абсолютный путь от корня)
+        parent, _, name = path.rpartition('/')
+        parent = self.add_dir(parent)
+        full = _join(parent, name)
+        if full not in self.nodes:
+            self.children[parent].append(name)
+        self.nodes[full] = {'type': 'file', 'data': data}
+
+    # Нахождение узла по пути (абсолютному или относительному от cwd)
     def resolve(self, path):
-        if isinstance(path, str):
-            # Если строка, она должна быть абсолютной
-            if path.startswith('/'):
-                parts = path.strip('/').split('/') if path.strip('/') else []
-            else:
-                # Относительный путь не поддерживается в resolve, только абсолютный
-                # Для текущего пути используем self.cwd
-                raise ValueError("Use resolve([]) for current path or pass absolute path list.")
-        else:
-            # Предполагаем, что это список (абсолютный путь от корня)
-            parts = path
-
-        cur = self.root
-        for p in parts:
-            if p == '' or p == '.':
-                continue
-            # .. не обрабатывается здесь
-            if p not in cur or not isinstance(cur[p], dict):
-                return None
-            cur = cur[p]
-        return cur
+        if path == '' or path == '.':
+            return self._ancestor_cache[-1][1]
+        return self.nodes.get(self._canon(path))
 
-    # Переход в каталог
+    # Переход в каталог: путь разбирается и проверяется за один проход,
+    # начиная с кэша предков (абсолютный путь — от корня, относительный — от cwd)
     def cd(self, path):
-        # --- ИСПРАВЛЕНИЕ CD: Обработка относительного и абсолютного пути ---
-        if path.startswith('/'):
-            new_parts = path.strip('/').split('/') if path.strip('/') else []
-        else:
-            # Относительный путь: добавляем к текущему
-            new_parts = self.cwd + (path.split('/') if path else [])
-
-        # --- ИСПРАВЛЕНИЕ CD: Обработка . и .. ---
-        resolved_cwd = []
-        for part in new_parts:
-            if part == '.' or part == '':
+        stack = self._ancestor_cache[:1] if path.startswith('/') else self._ancestor_cache[:]
+        for part in path.split('/'):
+            if part == '' or part == '.':
                 continue
             elif part == '..':
-                if resolved_cwd:
-                    resolved_cwd.pop()
+                if len(stack) > 1:
+                    stack.pop()
                 # else: уже на вершине, остаёмся на месте
-            else:
-                resolved_cwd.append(part)
-
-        # --- ИСПРАВЛЕНИЕ CD: Проверка, что путь существует и это каталог ---
-        target_node = self.resolve(resolved_cwd)
-        if target_node is None:
-            # Путь не существует
-            return False
-        if 'type' in target_node and target_node['type'] == 'file':
-            # Это файл, а не каталог
-            return False
-
-        # Применяем путь
-        self.cwd = resolved_cwd
+                continue
+            child = _join(stack[-1][0], part)
+            node = self.nodes.get(child)
+            # Каждый уровень должен существовать и быть каталогом, а не файлом
+            if node is None or node.__class__ is not DirNode:
+                return False
+            stack.append((child, node))
+
+        self._ancestor_cache = stack
+        self.cwd = stack[-1][0]
         return True
 
+    # Поиск по имени узла: обход дерева в прямом порядке (как в архиве)
+    # по индексу каталогов, с явным стеком вместо рекурсии.
+    # Пути возвращаются от корня без ведущего "/": "vfs/1/1.1"
+    def find(self, name):
+        results = []
+        stack = [('/', iter(self.children['/']))]
+        while stack:
+            parent, names = stack[-1]
+            for key in names:
+                full_path = _join(parent, key)
+                if key == name:
+                    results.append(full_path[1:])
+                if self.nodes[full_path].__class__ is DirNode:
+                    stack.append((full_path, iter(self.children[full_path])))
+                    break
+            else:
+                stack.pop()
+        return results
 
     # Список файлов
     def ls(self):
-        node = self.resolve(self.cwd) # Используем текущий путь как абсолютный
-        if node is None:
-            return []
-        # Проверяем, что это каталог, а не файл
-        if 'type' in node and node['type'] == 'file':
-            print("ls: not a directory")
-            return []
-        return list(node.keys()) if node else []
+        return list(self.children.get(self.cwd, ()))
+
+    # Список файлов одной строкой — join прямо по индексу каталога, без копии
+    def ls_str(self):
+        return "  ".join(self.children.get(self.cwd, ()))
 
     # Текущий путь
     def pwd(self):
-        return "/" + "/".join(self.cwd)
+        return self.cwd
+
+    # Приглашение; пересобирается, только если сменился cwd или шаблон
+    def prompt(self, prompt_override=None):
+        key = (self.cwd, prompt_override)
+        if self._prompt_cache[0] != key:
+            self._prompt_cache = (key, _render_prompt(self.cwd, prompt_override))
+        return self._prompt_cache[1]
+
+
+def _join(parent, name):
+    return parent + name if parent == '/' else parent + '/' + name
 
 
 # -------------------------------------------------------------
 # Утилиты
 # -------------------------------------------------------------
+def _env_repl(m):
+    name = m.group(1) or m.group(2)
+    if name is None:   # экранированный \$
+        return '$'
+    return os.environ.get(name, '')
+
+
 def expand_env(token):
-    token = token.replace(r'\$', '\0')
-    pattern = re.compile(r'\$(\w+)|\$\{([^}]+)\}')
-    def repl(m):
-        name = m.group(1) or m.group(2)
-        return os.environ.get(name, '')
-    result = pattern.sub(repl, token)
-    return result.replace('\0', '$')
+    if '$' not in token:   # большинство токенов без переменных
+        return token
+    return _ENV_SUB(_env_repl, token)
+
+
+def _render_prompt(cwd, prompt_override):
+    if prompt_override:
+        values = {'u': _USER, 'h': _HOST, 'd': cwd}
+        return _PROMPT_SUB(lambda m: values[m.group(1)], prompt_override)
+    return f"{_USER}@{_HOST}:{cwd}$ "
 
 
 def make_prompt(vfs, prompt_override=None):
-    user = os.environ.get('USER') or os.environ.get('USERNAME') or 'user'
-    host = socket.gethostname()
-    cwd = vfs.pwd() if vfs else "~"
+    if vfs:
+        return vfs.prompt(prompt_override)
+    return _render_prompt("~", prompt_override)
 
-    if prompt_override:
-        return prompt_override.replace('%u', user).replace('%h', host).replace('%d', cwd)
-    return f"{user}@{host}:{cwd}$ "
+
+def _unquote(word):
+    return ''.join(_DQ_ESC_SUB(r'\1', dq) + sq + esc + plain
+                   for dq, sq, esc, plain in _PIECE_RE.findall(word))
 
 
 def parse_input(line):
-    try:
-        parts = shlex.split(line)
-    except ValueError as e:
-        print(f"Parse error: {e}")
-        return None, None
+    parts = []
+    for m in _TOKEN_RE.finditer(line):
+        word = m.group(1)
+        if word is None:
+            # Строка некорректна — разбор и текст ошибки оставляем shlex
+            try:
+                parts = shlex.split(line)
+            except ValueError as e:
+                print(f"Parse error: {e}")
+                return None, None
+            break
+        parts.append(_unquote(word) if _HAS_QUOTES(word) else word)
     expanded = [expand_env(tok) for tok in parts]
     if not expanded:
         return '', []
-    return expanded[0], expanded[1:]
+    # Интернированное имя совпадает с ключом _COMMANDS по указателю
+    return sys.intern(expanded[0]), expanded[1:]
 
 
 # -------------------------------------------------------------
 # Загрузка VFS из ZIP
 # -------------------------------------------------------------
+def _decode_payload(raw):
+    # Если файл похож на base64-данные — попробуем декодировать
+    if _looks_base64(raw):
+        try:
+            raw = base64.b64decode(raw)
+        except ValueError:
+            pass
+    return raw
+
+
 def load_vfs_from_zip(path):
     v = VFS()
     try:
         with zipfile.ZipFile(path, 'r') as z:
-            for name in z.namelist():
+            for info in z.infolist():
+                name = info.filename
                 if name.endswith('/'):
                     v.add_dir(name.rstrip('/'))
                 else:
-                    raw = z.read(name)
-                    # Если файл — base64-данные — попробуем декодировать
-                    try:
-                        raw = base64.b64decode(raw)
-                    except Exception:
-                        pass
-                    v.add_file(name, raw)
+                    v.add_file(name, _decode_payload(z.read(info)))
         return v
     except Exception as e:
         print(f"VFS load error: {e}")
@@ -171,121 +257,135 @@ def load_vfs_from_zip(path):
 # -------------------------------------------------------------
 # Обработка команд
 # -------------------------------------------------------------
-def handle_command(cmd, args, vfs, script_mode=False):
-    global command_history # Для доступа к глобальной истории
+# Каждая команда — функция (args, vfs, script_mode) -> продолжать ли работу
+def _cmd_exit(args, vfs, script_mode):
+    return False
 
-    # exit
-    if cmd == 'exit':
-        return False
 
-    # echo
-    if cmd == 'echo':
-        print(" ".join(args))
-        return True
+def _cmd_echo(args, vfs, script_mode):
+    print(" ".join(args))
+    return True
 
-    # pwd
-    if cmd == 'pwd':
-        print(vfs.pwd())
-        return True
 
-    # ls
-    if cmd == 'ls':
-        items = vfs.ls()
-        # Вывод уже производится в ls, если это файл
-        if items: # Только если список не пустой (и не None)
-            print("  ".join(items))
-        return True
+def _cmd_pwd(args, vfs, script_mode):
+    print(vfs.pwd())
+    return True
 
-    # cd
-    if cmd == 'cd':
-        if not args:
-            print("cd: missing argument")
-            return False if script_mode else True
-        if not vfs.cd(args[0]):
-            print(f"cd: no such directory: {args[0]}")
-            return False if script_mode else True
-        return True
 
-    # find
-    if cmd == 'find':
-        if not args:
-            print("find: missing argument")
-            return False if script_mode else True
-        search_name = args[0]
+def _cmd_ls(args, vfs, script_mode):
+    listing = vfs.ls_str()
+    if listing: # Только если каталог не пустой
+        print(listing)
+    return True
 
-        results = []
-        def find_recursive(node, current_path):
-            for key, value in node.items():
-                full_path = current_path + '/' + key if current_path else key
-                if key == search_name:
-                    results.append(full_path)
-                if isinstance(value, dict) and 'type' not in value:
-                    find_recursive(value, full_path)
-
-        find_recursive(vfs.root, '')
-        for res in results:
-            print(res)
-        return True
 
-    # history
-    if cmd == 'history':
-        for i, entry in enumerate(command_history, 1):
-            print(f"{i:3}: {entry}")
-        return True
+def _cmd_cd(args, vfs, script_mode):
+    if not args:
+        print("cd: missing argument")
+        return False if script_mode else True
+    if not vfs.cd(args[0]):
+        print(f"cd: no such directory: {args[0]}")
+        return False if script_mode else True
+    return True
 
-    # help
-    if cmd == 'help':
-        print("Available commands:")
-        print("  exit")
-        print("  echo <arg>")
-        print("  pwd")
-        print("  ls")
-        print("  cd <path>")
-        print(" cd .. (возврат)")
-        print("  find <file_or_catalog>")
-        print("  history")
-        print("  help")
-        return True
 
-    # неизвестная команда
-    print(f"Command not found: {cmd}")
-    return False if script_mode else True
+def _cmd_find(args, vfs, script_mode):
+    if not args:
+        print("find: missing argument")
+        return False if script_mode else True
+    results = vfs.find(args[0])
+    # Один вызов write вместо print на каждую строку
+    if results:
+        sys.stdout.write('\n'.join(results))
+        sys.stdout.write('\n')
+    return True
+
+
+def _cmd_history(args, vfs, script_mode):
+    sys.stdout.writelines(f"{i:3}: {entry}\n"
+                          for i, entry in enumerate(command_history, _history_offset + 1))
+    return True
+
+
+def _cmd_help(args, vfs, script_mode):
+    print("Available commands:")
+    print("  exit")
+    print("  echo <arg>")
+    print("  pwd")
+    print("  ls")
+    print("  cd <path>")
+    print(" cd .. (возврат)")
+    print("  find <file_or_catalog>")
+    print("  history")
+    print("  help")
+    return True
+
+
+_COMMANDS = {sys.intern(name): handler for name, handler in {
+    'exit': _cmd_exit,
+    'echo': _cmd_echo,
+    'pwd': _cmd_pwd,
+    'ls': _cmd_ls,
+    'cd': _cmd_cd,
+    'find': _cmd_find,
+    'history': _cmd_history,
+    'help': _cmd_help,
+}.items()}
+
+
+def handle_command(cmd, args, vfs, script_mode=False):
+    handler = _COMMANDS.get(cmd)
+    if handler is None:
+        # неизвестная команда
+        print(f"Command not found: {cmd}")
+        return False if script_mode else True
+    return handler(args, vfs, script_mode)
 
 
 # -------------------------------------------------------------
 # Выполнение стартового скрипта
 # -------------------------------------------------------------
 def run_startup_script(path, prompt, vfs):
-    if not os.path.exists(path):
+    try:
+        f = open(path, 'r', encoding='utf-8')
+    except FileNotFoundError:
         print(f"Startup script not found: {path}")
         return False
-
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-    except Exception as e:
+    except OSError as e:
         print(f"Script read error: {e}")
         return False
 
-    for raw in lines:
-        line = raw.rstrip("\n")
-        if line.strip().startswith('#'):
-            print(f"# {line.strip()[1:].strip()}")
-            continue
+    # Скрипт читается и выполняется построчно, без загрузки целиком.
+    # try охватывает только чтение: ошибки команд и вывода — не ошибки чтения
+    with f:
+        while True:
+            try:
+                raw = next(f, None)
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"Script read error: {e}")
+                return False
+            if raw is None:
+                break
+
+            line = raw.rstrip("\n")
+            comment = _COMMENT_MATCH(line)
+            if comment:
+                print(f"# {comment.group(1).strip()}")
+                continue
 
-        print(make_prompt(vfs, prompt) + line)
-        cmd, args = parse_input(line)
-        if cmd is None:
-            print("Script: parse error")
-            return False
+            print(make_prompt(vfs, prompt), line, sep="")
+            cmd, args = parse_input(line)
+            if cmd is None:
+                print("Script: parse error")
+                return False
 
-        # --- ДОБАВЛЕНО: Сохранение команды в историю ---
-        command_history.append(line)
+            # --- ДОБАВЛЕНО: Сохранение команды в историю ---
+            add_history(line)
 
-        ok = handle_command(cmd, args, vfs, script_mode=True)
-        if not ok:
-            print(f"Script stopped at: {line}")
-            return False
+            ok = handle_command(cmd, args, vfs, script_mode=True)
+            if not ok:
+                print(f"Script stopped at: {line}")
+                return False
 
     return True
 
@@ -306,7 +406,7 @@ def repl(prompt_override, vfs):
             continue
 
         # --- ДОБАВЛЕНО: Сохранение команды в историю ---
-        command_history.append(line)
+        add_history(line)
 
         cont = handle_command(cmd, args, vfs, script_mode=False)
         if not cont: